@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Non-blocking structured access log for the Payment App
+Request handlers enqueue JSON entries; a background thread batches them to
+disk with size-based rotation, dropping entries when the queue is full
+"""
+
+import os
+import json
+import queue
+import threading
+import time
+
+ACCESS_LOG_PATH = os.path.join('logs', 'access.log')
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Entries buffered before new ones are dropped
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+
+
+class AccessLogger:
+    """Bounded queue drained by a single writer thread"""
+
+    def __init__(self, path=ACCESS_LOG_PATH, max_bytes=MAX_LOG_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, entry):
+        """Enqueue an entry without blocking; drops it if the writer is behind"""
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count_dropped(1)
+
+    def _count_dropped(self, count):
+        # Handler threads and the writer both update the counter
+        with self._dropped_lock:
+            self.dropped += count
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        """Write a batch in one call, reporting drops since the last batch"""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            batch.append({'event': 'access_log_dropped', 'count': dropped, 'timestamp': time.time()})
+
+        # Never let logging failures take the writer thread down
+        try:
+            if self._file.closed:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(''.join(json.dumps(entry, default=str) + '\n' for entry in batch))
+            self._file.flush()
+        except (OSError, ValueError):
+            self._count_dropped(len(batch))
+            return
+
+        if self._file.tell() >= self.max_bytes:
+            try:
+                self._rotate()
+            except (OSError, ValueError):
+                # The batch is on disk; rotation is retried after the next one
+                pass
+
+    def _rotate(self):
+        """Shift access.log -> access.log.1 -> ... keeping backup_count files"""
+        self._file.close()
+        try:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            if self.backup_count:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        finally:
+            # Keep writing to the current file even if the rename failed
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self, timeout=5):
+        """Flush queued entries and stop the writer thread"""
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._file.close()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Append-only binary audit journal for the Payment App
+Every ledger event is written as a fixed-width, checksummed record into
+segmented files so audits can run without touching the live database
+"""
+
+import os
+import sys
+import mmap
+import struct
+import sqlite3
+import zlib
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from transaction_archive import ARCHIVE_DIR, archive_months, archive_path
+
+SEGMENT_MAGIC = b'PAYJRNL1'
+SEGMENT_HEADER = struct.Struct('<8sII')  # magic, version, record size
+SEGMENT_VERSION = 1
+
+# timestamp (us), event type, status, amount, transaction id, sender id, recipient id
+RECORD_BODY = struct.Struct('<qBBxxd48s32s32s')
+RECORD_CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD_BODY.size + RECORD_CRC.size
+
+# Records per segment file before rolling over to a new one
+SEGMENT_RECORDS = 65536
+# One sparse index entry every INDEX_STRIDE records
+INDEX_STRIDE = 1024
+# Slack between a transfer's createdAt and its journal timestamp when verifying
+VERIFY_MARGIN_SECONDS = 60
+# Default lookback of the verify command, keeps routine audits bounded
+VERIFY_WINDOW_DAYS = 7
+
+EVENT_TRANSFER = 1
+EVENT_BALANCE = 2
+EVENT_NAMES = {EVENT_TRANSFER: 'TRANSFER', EVENT_BALANCE: 'BALANCE'}
+
+STATUS_CODES = {'PENDING': 0, 'COMPLETED': 1, 'FAILED': 2, 'CANCELLED': 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+class JournalCorruptError(Exception):
+    """Raised when a journal record fails its checksum"""
+
+
+def _encode(value, size):
+    """Encode an identifier into a fixed-width, NUL padded field"""
+    raw = (value or '').encode('utf-8')
+    if len(raw) > size:
+        raise ValueError(f"Identifier too long for journal field: {value}")
+    return raw
+
+
+def pack_record(timestamp_us, event_type, status, amount, transaction_id, sender_id, recipient_id):
+    """Pack a single journal record including its CRC32"""
+    body = RECORD_BODY.pack(
+        timestamp_us,
+        event_type,
+        STATUS_CODES.get(status, 0),
+        float(amount),
+        _encode(transaction_id, 48),
+        _encode(sender_id, 32),
+        _encode(recipient_id, 32)
+    )
+    return body + RECORD_CRC.pack(zlib.crc32(body))
+
+
+def unpack_record(buffer, offset):
+    """Unpack and verify the record at offset"""
+    body = buffer[offset:offset + RECORD_BODY.size]
+    (crc,) = RECORD_CRC.unpack_from(buffer, offset + RECORD_BODY.size)
+    if zlib.crc32(body) != crc:
+        raise JournalCorruptError(f"Checksum mismatch at offset {offset}")
+
+    timestamp_us, event_type, status, amount, txn, sender, recipient = RECORD_BODY.unpack(body)
+    return {
+        'timestamp': timestamp_us,
+        'event': EVENT_NAMES.get(event_type, str(event_type)),
+        'status': STATUS_NAMES.get(status, str(status)),
+        'amount': amount,
+        'transactionId': txn.rstrip(b'\0').decode('utf-8'),
+        'senderId': sender.rstrip(b'\0').decode('utf-8'),
+        'recipientId': recipient.rstrip(b'\0').decode('utf-8')
+    }
+
+
+def _segment_paths(directory):
+    """Return the segment files of a journal directory in order"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith('segment-') and n.endswith('.bin'))
+    return [os.path.join(directory, n) for n in names]
+
+
+class AuditJournal:
+    """Writer side of the journal; appends records to the active segment"""
+
+    def __init__(self, directory='journal'):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_index = 0
+        self._segment_records = 0
+        self._last_timestamp = 0
+        os.makedirs(directory, exist_ok=True)
+        self._open_active_segment()
+
+    def _open_active_segment(self):
+        """Reopen the newest segment, trimming any torn trailing record"""
+        paths = _segment_paths(self.directory)
+        if not paths:
+            self._start_segment(1)
+            return
+
+        path = paths[-1]
+        self._segment_index = int(os.path.basename(path)[8:-4])
+        size = os.path.getsize(path)
+        if size < SEGMENT_HEADER.size:
+            self._start_segment(self._segment_index)
+            return
+
+        records = (size - SEGMENT_HEADER.size) // RECORD_SIZE
+        self._file = open(path, 'r+b')
+
+        # Walk back over trailing records that fail their checksum, e.g. a
+        # zero-filled tail left by a crash before the data reached disk
+        last = None
+        while records:
+            self._file.seek(SEGMENT_HEADER.size + (records - 1) * RECORD_SIZE)
+            try:
+                last = unpack_record(self._file.read(RECORD_SIZE), 0)
+                break
+            except JournalCorruptError:
+                records -= 1
+
+        valid_size = SEGMENT_HEADER.size + records * RECORD_SIZE
+        if size != valid_size:
+            print(f"Audit journal: trimmed {size - valid_size} bytes of torn records from {path}",
+                  file=sys.stderr)
+            self._file.truncate(valid_size)
+        self._file.seek(valid_size)
+        self._segment_records = records
+        if last:
+            self._last_timestamp = last['timestamp']
+
+    def _start_segment(self, index):
+        """Create a fresh segment file and write its header"""
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.directory, f"segment-{index:08d}.bin")
+        self._file = open(path, 'w+b')
+        self._file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, RECORD_SIZE))
+        self._file.flush()
+        self._segment_index = index
+        self._segment_records = 0
+
+    def is_empty(self):
+        """True when nothing has been journaled yet"""
+        return self._segment_index == 1 and self._segment_records == 0
+
+    def _next_timestamp(self):
+        """Microsecond timestamp that never goes backwards within the journal"""
+        now = int(time.time() * 1_000_000)
+        self._last_timestamp = max(now, self._last_timestamp + 1)
+        return self._last_timestamp
+
+    def append(self, events):
+        """Append events, each a (event_type, status, amount, txn, sender, recipient) tuple"""
+        with self._lock:
+            chunk = []
+            for event in events:
+                if self._segment_records >= SEGMENT_RECORDS:
+                    self._file.write(b''.join(chunk))
+                    chunk = []
+                    self._start_segment(self._segment_index + 1)
+                chunk.append(pack_record(self._next_timestamp(), *event))
+                self._segment_records += 1
+            self._file.write(b''.join(chunk))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_transfers(self, rows):
+        """Journal transaction rows as (transactionId, senderId, recipientId, amount, status)"""
+        self.append(
+            (EVENT_TRANSFER, status, amount, txn, sender, recipient)
+            for txn, sender, recipient, amount, status in rows
+        )
+
+    def record_balances(self, balances):
+        """Journal balance checkpoints as (userId, balance) pairs"""
+        self.append(
+            (EVENT_BALANCE, 'COMPLETED', balance, '', user_id, '')
+            for user_id, balance in balances
+        )
+
+    def checkpoint_balances(self, db_path='dev.db'):
+        """Snapshot every user's balance into the journal as the audit baseline"""
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, balance FROM users')
+        balances = cursor.fetchall()
+        conn.close()
+        self.record_balances(balances)
+
+    def close(self):
+        """Close the active segment"""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class JournalReader:
+    """Read side of the journal backed by mmap and a sparse timestamp index"""
+
+    def __init__(self, directory='journal'):
+        self.segments = []
+        for path in _segment_paths(directory):
+            size = os.path.getsize(path)
+            records = max(0, (size - SEGMENT_HEADER.size) // RECORD_SIZE)
+            if not records:
+                continue
+
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), SEGMENT_HEADER.size + records * RECORD_SIZE,
+                                   access=mmap.ACCESS_READ)
+            magic, version, record_size = SEGMENT_HEADER.unpack_from(mapped, 0)
+            if magic != SEGMENT_MAGIC or record_size != RECORD_SIZE:
+                mapped.close()
+                raise JournalCorruptError(f"Unrecognised segment header in {path}")
+
+            # Sparse index: (timestamp, record number) every INDEX_STRIDE records
+            index = [(self._timestamp_at(mapped, i), i) for i in range(0, records, INDEX_STRIDE)]
+            self.segments.append({'path': path, 'map': mapped, 'records': records, 'index': index})
+
+    @staticmethod
+    def _timestamp_at(mapped, record_number):
+        return struct.unpack_from('<q', mapped, SEGMENT_HEADER.size + record_number * RECORD_SIZE)[0]
+
+    def _scan_segment(self, segment, start_record):
+        mapped = segment['map']
+        for i in range(start_record, segment['records']):
+            yield unpack_record(mapped, SEGMENT_HEADER.size + i * RECORD_SIZE)
+
+    def replay(self):
+        """Yield every record in journal order"""
+        for segment in self.segments:
+            yield from self._scan_segment(segment, 0)
+
+    def range_scan(self, start_us, end_us):
+        """Yield records with start_us <= timestamp < end_us"""
+        first_stamps = [segment['index'][0][0] for segment in self.segments]
+        position = max(0, bisect_right(first_stamps, start_us) - 1)
+
+        for segment in self.segments[position:]:
+            # Jump to the last sparse index entry before start_us
+            stamps = [stamp for stamp, _ in segment['index']]
+            slot = max(0, bisect_left(stamps, start_us) - 1)
+
+            for record in self._scan_segment(segment, segment['index'][slot][1]):
+                if record['timestamp'] >= end_us:
+                    return
+                if record['timestamp'] >= start_us:
+                    yield record
+
+    def expected_balances(self):
+        """Replay checkpoints and completed transfers into per-user balances"""
+        balances = {}
+        for record in self.replay():
+            if record['event'] == 'BALANCE':
+                balances[record['senderId']] = record['amount']
+            elif record['event'] == 'TRANSFER' and record['status'] == 'COMPLETED':
+                sender, recipient = record['senderId'], record['recipientId']
+                balances[sender] = balances.get(sender, 0.0) - record['amount']
+                balances[recipient] = balances.get(recipient, 0.0) + record['amount']
+        return balances
+
+    def verify_balances(self, db_path='dev.db', tolerance=0.005):
+        """Compare replayed balances with users.balance; returns the mismatches"""
+        expected = self.expected_balances()
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, balance FROM users')
+        actual = dict(cursor.fetchall())
+        conn.close()
+
+        mismatches = []
+        for user_id in sorted(set(expected) | set(actual)):
+            journal_balance = expected.get(user_id)
+            db_balance = actual.get(user_id)
+            if journal_balance is None or db_balance is None or abs(journal_balance - db_balance) > tolerance:
+                mismatches.append({'userId': user_id, 'journal': journal_balance, 'database': db_balance})
+        return mismatches
+
+    def first_timestamp(self):
+        """Timestamp of the oldest record, or None for an empty journal"""
+        if not self.segments:
+            return None
+        return self.segments[0]['index'][0][0]
+
+    def verify_transactions(self, db_path='dev.db', archive_dir=ARCHIVE_DIR, window_days=None):
+        """Cross-check journaled transfer ids against the database and archives
+
+        Only transactions created since the first journal record, or within
+        the last window_days, are compared; the database side reads just that
+        createdAt range from the hot table and the archive months it spans.
+        Transfers whose latest journal status is CANCELLED were never
+        committed and are ignored. Returns the ids missing on either side.
+        """
+        start_us = self.first_timestamp()
+        if start_us is None:
+            return {'missingFromJournal': [], 'missingFromDatabase': []}
+        if window_days:
+            start_us = max(start_us, int((time.time() - window_days * 86400) * 1_000_000))
+
+        statuses = {}
+        for record in self.range_scan(start_us, float('inf')):
+            if record['event'] == 'TRANSFER':
+                statuses[record['transactionId']] = record['status']
+        journal_ids = {txn for txn, status in statuses.items() if status != 'CANCELLED'}
+
+        # createdAt is CURRENT_TIMESTAMP, i.e. UTC with second resolution, and
+        # is set just before the transfer is journaled
+        def utc(timestamp_us):
+            return datetime.fromtimestamp(timestamp_us // 1_000_000, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        since = utc(start_us)
+        # Journaled ids near the window start may carry a slightly older createdAt
+        lookup_since = utc(start_us - VERIFY_MARGIN_SECONDS * 1_000_000)
+        query = 'SELECT transactionId, createdAt FROM transactions WHERE createdAt >= ?'
+
+        conn = sqlite3.connect(db_path)
+        database_rows = conn.execute(query, (lookup_since,)).fetchall()
+        conn.close()
+        for month in archive_months(archive_dir):
+            if month < lookup_since[:7]:
+                break
+            archive = sqlite3.connect(f"file:{archive_path(archive_dir, month)}?mode=ro", uri=True)
+            database_rows.extend(archive.execute(query, (lookup_since,)).fetchall())
+            archive.close()
+
+        database_ids = {txn for txn, _ in database_rows}
+        recent_ids = {txn for txn, created in database_rows if created >= since}
+        return {
+            'missingFromJournal': sorted(recent_ids - journal_ids),
+            'missingFromDatabase': sorted(journal_ids - database_ids)
+        }
+
+    def close(self):
+        """Release every mapped segment"""
+        for segment in self.segments:
+            segment['map'].close()
+        self.segments = []
+
+
+def _parse_time(value):
+    """Parse an ISO timestamp into journal microseconds"""
+    return int(datetime.fromisoformat(value).timestamp() * 1_000_000)
+
+
+def main():
+    """Command line audit entry point"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('replay', 'scan', 'verify'):
+        print("Usage: audit_journal.py replay | scan <from-iso> <to-iso> | verify [db-path] [window-days]")
+        sys.exit(1)
+
+    reader = JournalReader('journal')
+    try:
+        command = sys.argv[1]
+        if command == 'replay':
+            for record in reader.replay():
+                print(record)
+        elif command == 'scan':
+            for record in reader.range_scan(_parse_time(sys.argv[2]), _parse_time(sys.argv[3])):
+                print(record)
+        else:
+            db_path = sys.argv[2] if len(sys.argv) > 2 else 'dev.db'
+            # 0 checks every transaction since the journal started
+            window_days = float(sys.argv[3]) if len(sys.argv) > 3 else VERIFY_WINDOW_DAYS
+            failed = False
+
+            mismatches = reader.verify_balances(db_path)
+            if mismatches:
+                failed = True
+                print("Balance mismatches found:")
+                for mismatch in mismatches:
+                    print(f"  - {mismatch['userId']}: journal={mismatch['journal']} database={mismatch['database']}")
+            else:
+                print("All balances match the journal")
+
+            gaps = reader.verify_transactions(db_path, window_days=window_days)
+            for label, key in (("Transactions missing from the journal", 'missingFromJournal'),
+                               ("Journaled transactions missing from the database", 'missingFromDatabase')):
+                if gaps[key]:
+                    failed = True
+                    print(f"{label}:")
+                    for transaction_id in gaps[key]:
+                        print(f"  - {transaction_id}")
+            if not (gaps['missingFromJournal'] or gaps['missingFromDatabase']):
+                print("All transactions are journaled")
+
+            if failed:
+                sys.exit(1)
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
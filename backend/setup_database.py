@@ -8,6 +8,7 @@ import sqlite3
 import hashlib
 import json
 from datetime import datetime, timedelta
+from transaction_archive import ensure_transaction_indexes
 
 def create_tables(cursor):
     """Create all necessary tables"""
@@ -51,6 +52,9 @@ def create_tables(cursor):
         )
     ''')
     
+    # Indexes for history queries and the archival job
+    ensure_transaction_indexes(cursor)
+    
     # OTP codes table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS otp_codes (
@@ -124,10 +128,18 @@ def create_sample_users(cursor):
     ]
     
     for user in sample_users:
+        # Upsert rather than INSERT OR REPLACE so update triggers fire
         cursor.execute('''
-            INSERT OR REPLACE INTO users 
+            INSERT INTO users
             (id, email, passwordHash, fullName, phoneNumber, balance, role)
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                email = excluded.email,
+                passwordHash = excluded.passwordHash,
+                fullName = excluded.fullName,
+                phoneNumber = excluded.phoneNumber,
+                balance = excluded.balance,
+                role = excluded.role
         ''', (
             user['id'],
             user['email'],
@@ -11,13 +11,122 @@ import sqlite3
 import hashlib
 import jwt
 import time
+import uuid
+import csv
+import io
+import math
+import sys
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta
+from audit_journal import AuditJournal
+from velocity_limits import VelocityLimiter
+from transaction_archive import COLUMNS as TRANSACTION_COLUMNS, ensure_transaction_indexes, fetch_user_transactions
+from user_search import PhonePrefixIndex, ensure_search_index, search_users
+from access_log import AccessLogger
 
 # Simple JWT secret (in production, use a proper secret)
 JWT_SECRET = "your-super-secret-jwt-key-change-this-in-production"
 
+# Upper bound on transfers accepted by a single batch payout request
+MAX_BATCH_SIZE = 5000
+BATCH_MODES = ('ALL_OR_NOTHING', 'BEST_EFFORT')
+
+# Page size limits for transaction history
+DEFAULT_HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 500
+
+# Append-only audit journal, opened in main()
+JOURNAL = None
+
+# Per-user transfer velocity limits, rebuilt in main()
+VELOCITY = None
+
+# In-memory phone number prefix index for recipient search, loaded in main()
+PHONE_INDEX = None
+
+# Structured JSON access log written off the request path, opened in main()
+ACCESS_LOG = None
+
+def is_valid_amount(amount):
+    """True for a positive, finite JSON number that fits a float exactly"""
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return False
+    if isinstance(amount, int):
+        # Huge JSON integers would overflow math.isfinite and float columns
+        return 0 < amount < 2 ** 53
+    return math.isfinite(amount) and amount > 0
+
 class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
+    def handle_one_request(self):
+        """Handle a request and enqueue its access log entry"""
+        self.request_id = uuid.uuid4().hex
+        self.user_id = None
+        self.status_code = None
+        self.error_message = None
+        started = time.perf_counter()
+
+        try:
+            super().handle_one_request()
+        except Exception as e:
+            # Unhandled handler errors still get a logged 500 and, when nothing
+            # has been sent yet, a response carrying the request id
+            self.error_message = f"{type(e).__name__}: {e}"
+            if self.status_code is None:
+                try:
+                    self.send_error(500, "Server error")
+                except Exception:
+                    self.status_code = 500
+                self.error_message = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.log_access(started)
+
+    def log_access(self, started):
+        """Enqueue the structured access log entry for the current request"""
+        if ACCESS_LOG is not None and self.status_code is not None:
+            ACCESS_LOG.log({
+                'timestamp': datetime.now().isoformat(),
+                'requestId': self.request_id,
+                'method': self.command,
+                'route': urlparse(getattr(self, 'path', '')).path,
+                'status': self.status_code,
+                'latencyMs': round((time.perf_counter() - started) * 1000, 3),
+                'userId': self.user_id,
+                'client': self.client_address[0],
+                'error': self.error_message
+            })
+
+    def parse_request(self):
+        """Parse the request, honouring a caller supplied X-Request-ID"""
+        if not super().parse_request():
+            return False
+        request_id = self.headers.get('X-Request-ID', '')
+        if 0 < len(request_id) <= 64 and request_id.replace('-', '').isalnum():
+            self.request_id = request_id
+        return True
+
+    def send_response(self, code, message=None):
+        """Send the status line plus the request id header"""
+        self.status_code = code
+        super().send_response(code, message)
+        self.send_header('X-Request-ID', self.request_id)
+
+    def send_error(self, code, message=None, explain=None):
+        """Send an error page that carries the request id"""
+        self.error_message = message
+        if explain is None:
+            explain = self.responses.get(code, ('', ''))[1]
+        super().send_error(code, message, f"{explain} (request id: {self.request_id})")
+
+    def log_message(self, format, *args):
+        """Silence the synchronous stderr log; requests go to ACCESS_LOG"""
+
+    def decode_token(self, token):
+        """Decode a JWT and remember the user id for the access log"""
+        decoded = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+        self.user_id = decoded.get('userId')
+        return decoded
+
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
@@ -34,6 +143,12 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
             self.send_health_response()
         elif parsed_path.path == '/api/users/profile':
             self.send_profile_response()
+        elif parsed_path.path == '/api/users/search':
+            self.send_user_search_response(parsed_path)
+        elif parsed_path.path == '/api/transactions':
+            self.send_transactions_response(parsed_path)
+        elif parsed_path.path == '/api/transactions/export':
+            self.send_transactions_export(parsed_path)
         else:
             self.send_error(404, "Not Found")
 
@@ -49,9 +164,51 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
             self.handle_generate_qr()
         elif parsed_path.path == '/api/transactions':
             self.handle_create_transaction()
+        elif parsed_path.path == '/api/transactions/batch':
+            self.handle_create_transaction_batch()
         else:
             self.send_error(404, "Not Found")
 
+    def journal_transfers(self, rows):
+        """Write transaction rows to the audit journal before they are committed
+
+        Returns False when the journal write failed; the caller must roll back.
+        """
+        if JOURNAL is None:
+            return True
+        try:
+            JOURNAL.record_transfers(rows)
+            return True
+        except Exception as e:
+            self.report_journal_failure([row[0] for row in rows], e)
+            return False
+
+    def cancel_journaled_transfers(self, rows):
+        """Journal a CANCELLED record for transfers whose commit failed after journaling"""
+        if JOURNAL is None:
+            return
+        try:
+            JOURNAL.record_transfers([(txn, sender, recipient, amount, 'CANCELLED')
+                                      for txn, sender, recipient, amount, _ in rows])
+        except Exception as e:
+            self.report_journal_failure([row[0] for row in rows], e)
+
+    def journal_balances(self, balances):
+        """Write balance checkpoints to the audit journal before they are committed"""
+        if JOURNAL is None:
+            return True
+        try:
+            JOURNAL.record_balances(balances)
+            return True
+        except Exception as e:
+            self.report_journal_failure([user_id for user_id, _ in balances], e)
+            return False
+
+    def report_journal_failure(self, ids, error):
+        """Surface a failed journal write on stderr with the affected ids"""
+        shown = ', '.join(ids[:20]) + (f" (+{len(ids) - 20} more)" if len(ids) > 20 else '')
+        sys.stderr.write(f"Audit journal write failed for {shown}: {error}\n")
+
     def send_health_response(self):
         """Send health check response"""
         self.send_response(200)
@@ -78,7 +235,7 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
         
         try:
             # Decode JWT token
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+            decoded = self.decode_token(token)
             user_id = decoded['userId']
             
             # Get user from database
@@ -119,6 +276,125 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
         except jwt.InvalidTokenError:
             self.send_error(401, "Invalid token")
 
+    def send_user_search_response(self, parsed_path):
+        """Search recipients by name, email or phone number prefix"""
+        auth_header = self.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            self.send_error(401, "Unauthorized")
+            return
+            
+        token = auth_header[7:]
+        
+        try:
+            decoded = self.decode_token(token)
+            user_id = decoded['userId']
+            
+            params = parse_qs(parsed_path.query)
+            query = params.get('q', [''])[0]
+            try:
+                limit = int(params.get('limit', [10])[0])
+            except ValueError:
+                self.send_error(400, "Invalid limit")
+                return
+                
+            conn = sqlite3.connect('dev.db')
+            try:
+                users = search_users(conn, PHONE_INDEX, query, limit, exclude_id=user_id)
+            finally:
+                conn.close()
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            response = {
+                'users': users
+            }
+            self.wfile.write(json.dumps(response).encode())
+            
+        except jwt.InvalidTokenError:
+            self.send_error(401, "Invalid token")
+        except Exception as e:
+            self.send_error(500, f"Server error: {str(e)}")
+
+    def send_transactions_response(self, parsed_path):
+        """Send the user's transaction history (hot table and archives)"""
+        auth_header = self.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            self.send_error(401, "Unauthorized")
+            return
+            
+        token = auth_header[7:]
+        
+        try:
+            decoded = self.decode_token(token)
+            user_id = decoded['userId']
+            
+            params = parse_qs(parsed_path.query)
+            start = params.get('from', [None])[0]
+            end = params.get('to', [None])[0]
+            try:
+                limit = int(params.get('limit', [DEFAULT_HISTORY_LIMIT])[0])
+            except ValueError:
+                self.send_error(400, "Invalid limit")
+                return
+            limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+            
+            transactions = fetch_user_transactions(user_id, start, end, limit)
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            response = {
+                'transactions': transactions,
+                'count': len(transactions)
+            }
+            self.wfile.write(json.dumps(response).encode())
+            
+        except jwt.InvalidTokenError:
+            self.send_error(401, "Invalid token")
+        except Exception as e:
+            self.send_error(500, f"Server error: {str(e)}")
+
+    def send_transactions_export(self, parsed_path):
+        """Send the user's transactions in a date range as CSV"""
+        auth_header = self.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            self.send_error(401, "Unauthorized")
+            return
+            
+        token = auth_header[7:]
+        
+        try:
+            decoded = self.decode_token(token)
+            user_id = decoded['userId']
+            
+            params = parse_qs(parsed_path.query)
+            start = params.get('from', [None])[0]
+            end = params.get('to', [None])[0]
+            
+            transactions = fetch_user_transactions(user_id, start, end)
+            
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=TRANSACTION_COLUMNS)
+            writer.writeheader()
+            writer.writerows(transactions)
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Disposition', 'attachment; filename="transactions.csv"')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(output.getvalue().encode())
+            
+        except jwt.InvalidTokenError:
+            self.send_error(401, "Invalid token")
+        except Exception as e:
+            self.send_error(500, f"Server error: {str(e)}")
+
     def handle_login(self):
         """Handle login request"""
         content_length = int(self.headers['Content-Length'])
@@ -157,6 +433,8 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 self.send_error(401, "Account deactivated")
                 return
                 
+            self.user_id = user[0]
+            
             # Generate JWT token
             token = jwt.encode(
                 {'userId': user[0], 'exp': datetime.utcnow() + timedelta(hours=24)},
@@ -227,9 +505,21 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 INSERT INTO users (id, email, passwordHash, fullName, phoneNumber, balance, role)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, email, password_hash, fullName, phoneNumber, 0.0, 'USER'))
-            
+
+            # Journal the opening balance before the account is committed
+            if not self.journal_balances([(user_id, 0.0)]):
+                conn.rollback()
+                conn.close()
+                self.send_error(500, "Audit journal unavailable, registration not applied")
+                return
+
             conn.commit()
             conn.close()
+
+            # Name and email are indexed by the users_fts triggers
+            PHONE_INDEX.add(user_id, phoneNumber)
+            
+            self.user_id = user_id
             
             # Generate JWT token
             token = jwt.encode(
@@ -282,7 +572,7 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 return
                 
             token = auth_header[7:]
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+            decoded = self.decode_token(token)
             
             # Get user from database
             conn = sqlite3.connect('dev.db')
@@ -344,15 +634,20 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 return
                 
             token = auth_header[7:]
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+            decoded = self.decode_token(token)
             sender_id = decoded['userId']
+
+            # Same rules as batch items; a negative amount would move money backwards
+            if not is_valid_amount(amount):
+                self.send_error(400, "Invalid amount")
+                return
             
             # Get users from database
             conn = sqlite3.connect('dev.db')
             cursor = conn.cursor()
             
             # Check recipient exists
-            cursor.execute('SELECT id, fullName, isActive FROM users WHERE id = ?', (recipient_id,))
+            cursor.execute('SELECT id, fullName, isActive, role FROM users WHERE id = ?', (recipient_id,))
             recipient = cursor.fetchone()
             
             if not recipient or not recipient[2]:
@@ -361,7 +656,7 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 return
                 
             # Check sender balance
-            cursor.execute('SELECT balance FROM users WHERE id = ?', (sender_id,))
+            cursor.execute('SELECT balance, role FROM users WHERE id = ?', (sender_id,))
             sender = cursor.fetchone()
             
             if not sender:
@@ -373,6 +668,13 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 conn.close()
                 self.send_error(400, "Insufficient balance")
                 return
+
+            # Check sender and recipient velocity limits
+            velocity_error = VELOCITY.check(sender_id, sender[1], recipient_id, recipient[3], amount)
+            if velocity_error:
+                conn.close()
+                self.send_error(429, velocity_error)
+                return
                 
             # Create transaction
             transaction_id = f"TXN-{int(time.time())}-{sender_id[:8]}"
@@ -381,9 +683,25 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
                 (id, transactionId, senderId, recipientId, amount, status, description)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (transaction_id, transaction_id, sender_id, recipient_id, amount, 'PENDING', description))
-            
-            conn.commit()
-            conn.close()
+
+            # Journal before committing so no committed transfer lacks an audit record
+            journal_rows = [(transaction_id, sender_id, recipient_id, amount, 'PENDING')]
+            if not self.journal_transfers(journal_rows):
+                conn.rollback()
+                conn.close()
+                self.send_error(500, "Audit journal unavailable, transaction not applied")
+                return
+
+            try:
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                self.cancel_journaled_transfers(journal_rows)
+                raise
+            finally:
+                conn.close()
+
+            VELOCITY.record(sender_id, recipient_id, amount)
             
             self.send_response(201)
             self.send_header('Content-Type', 'application/json')
@@ -412,9 +730,196 @@ class PaymentAPIHandler(http.server.BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Server error: {str(e)}")
 
+    def handle_create_transaction_batch(self):
+        """Handle bulk transaction creation (payroll, refunds)"""
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+
+        try:
+            data = json.loads(post_data.decode('utf-8'))
+            if not isinstance(data, dict):
+                self.send_error(400, "JSON object required")
+                return
+            transfers = data.get('transfers')
+            mode = data.get('mode', 'ALL_OR_NOTHING')
+
+            # Get token from Authorization header
+            auth_header = self.headers.get('Authorization', '')
+            if not auth_header.startswith('Bearer '):
+                self.send_error(401, "Unauthorized")
+                return
+
+            token = auth_header[7:]
+            decoded = self.decode_token(token)
+            sender_id = decoded['userId']
+
+            if not isinstance(transfers, list) or not transfers:
+                self.send_error(400, "Transfers list required")
+                return
+
+            if len(transfers) > MAX_BATCH_SIZE:
+                self.send_error(400, f"Batch exceeds {MAX_BATCH_SIZE} transfers")
+                return
+
+            if mode not in BATCH_MODES:
+                self.send_error(400, "Mode must be ALL_OR_NOTHING or BEST_EFFORT")
+                return
+
+            conn = sqlite3.connect('dev.db')
+            cursor = conn.cursor()
+
+            # Check sender balance
+            cursor.execute('SELECT balance, role FROM users WHERE id = ?', (sender_id,))
+            sender = cursor.fetchone()
+
+            if not sender:
+                conn.close()
+                self.send_error(404, "Sender not found")
+                return
+
+            # Look up every distinct recipient with a single IN query
+            recipient_ids = list({t.get('recipientId') for t in transfers
+                                  if isinstance(t, dict) and isinstance(t.get('recipientId'), str)})
+            active_recipients = {}
+            if recipient_ids:
+                placeholders = ','.join('?' * len(recipient_ids))
+                cursor.execute(f'''
+                    SELECT id, role FROM users WHERE isActive = 1 AND id IN ({placeholders})
+                ''', recipient_ids)
+                active_recipients = dict(cursor.fetchall())
+
+            # Validate each transfer against the running balance
+            batch_prefix = f"TXN-{int(time.time())}-{sender_id[:8]}-{uuid.uuid4().hex[:8]}"
+            remaining = sender[0]
+            pending = {}
+            results = []
+            rows = []
+            for index, transfer in enumerate(transfers):
+                transfer = transfer if isinstance(transfer, dict) else {}
+                recipient_id = transfer.get('recipientId')
+                amount = transfer.get('amount')
+                description = transfer.get('description')
+                if description is None:
+                    description = ''
+
+                error = None
+                if not isinstance(recipient_id, str) or recipient_id not in active_recipients:
+                    error = "Recipient not found or inactive"
+                elif not is_valid_amount(amount):
+                    error = "Invalid amount"
+                elif not isinstance(description, str):
+                    error = "Invalid description"
+                elif remaining < amount:
+                    error = "Insufficient balance"
+                else:
+                    error = VELOCITY.check(sender_id, sender[1], recipient_id, active_recipients[recipient_id],
+                                           amount, pending=pending)
+
+                if error:
+                    results.append({'index': index, 'status': 'REJECTED', 'error': error})
+                    continue
+
+                remaining -= amount
+                for key in (('send', sender_id), ('receive', recipient_id)):
+                    count, total = pending.get(key, (0, 0.0))
+                    pending[key] = (count + 1, total + amount)
+                transaction_id = f"{batch_prefix}-{index}"
+                rows.append((transaction_id, transaction_id, sender_id, recipient_id, amount, 'PENDING', description))
+                results.append({
+                    'index': index,
+                    'status': 'PENDING',
+                    'transactionId': transaction_id,
+                    'recipientId': recipient_id,
+                    'amount': amount
+                })
+
+            rejected = len(transfers) - len(rows)
+            if mode == 'ALL_OR_NOTHING' and rejected:
+                conn.close()
+                rows = []
+                # Valid items are reported but nothing was written
+                for result in results:
+                    if result['status'] != 'REJECTED':
+                        result['status'] = 'NOT_APPLIED'
+                        del result['transactionId']
+            elif rows:
+                # Apply every accepted transfer inside one database transaction,
+                # journaling the batch before it is committed
+                journal_rows = [(row[0], row[2], row[3], row[4], row[5]) for row in rows]
+                journaled = False
+                try:
+                    conn.executemany('''
+                        INSERT INTO transactions
+                        (id, transactionId, senderId, recipientId, amount, status, description)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    if not self.journal_transfers(journal_rows):
+                        conn.rollback()
+                        self.send_error(500, "Audit journal unavailable, batch not applied")
+                        return
+                    journaled = True
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    if journaled:
+                        self.cancel_journaled_transfers(journal_rows)
+                    raise
+                finally:
+                    conn.close()
+
+                for row in rows:
+                    VELOCITY.record(row[2], row[3], row[4])
+            else:
+                conn.close()
+
+            self.send_response(201 if rows else 400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+
+            response = {
+                'message': 'Batch processed' if rows else 'Batch rejected, no transfers applied',
+                'mode': mode,
+                'accepted': len(rows),
+                'rejected': rejected,
+                'results': results
+            }
+            self.wfile.write(json.dumps(response).encode())
+
+        except json.JSONDecodeError:
+            self.send_error(400, "Invalid JSON")
+        except Exception as e:
+            self.send_error(500, f"Server error: {str(e)}")
+
 def main():
     """Start the server"""
+    global JOURNAL, VELOCITY, PHONE_INDEX, ACCESS_LOG
     PORT = 3001
+
+    # Open the audit journal; a brand new journal starts from current balances
+    JOURNAL = AuditJournal('journal')
+    if JOURNAL.is_empty():
+        JOURNAL.checkpoint_balances('dev.db')
+
+    # Databases created before the history indexes existed get them here
+    conn = sqlite3.connect('dev.db')
+    ensure_transaction_indexes(conn)
+    conn.commit()
+    conn.close()
+
+    # Rebuild velocity windows from recent transactions
+    VELOCITY = VelocityLimiter()
+    print(f"Loaded {VELOCITY.rebuild('dev.db')} recent transactions into velocity limits")
+
+    # Recipient search indexes
+    conn = sqlite3.connect('dev.db')
+    ensure_search_index(conn)
+    conn.close()
+    PHONE_INDEX = PhonePrefixIndex()
+    print(f"Indexed {PHONE_INDEX.load('dev.db')} phone numbers for recipient search")
+
+    ACCESS_LOG = AccessLogger()
+    print(f"Access log: {ACCESS_LOG.path}")
     
     print(f"Starting Payment App backend server on port {PORT}")
     print("Note: This is a simplified Python server for development")
@@ -427,14 +932,20 @@ def main():
         print("  POST /api/auth/login - User login")
         print("  POST /api/auth/register - User registration")
         print("  GET  /api/users/profile - Get user profile")
+        print("  GET  /api/users/search - Search recipients")
+        print("  GET  /api/transactions - Transaction history")
+        print("  GET  /api/transactions/export - Export transactions as CSV")
         print("  POST /api/payments/generate-qr - Generate QR code")
         print("  POST /api/transactions - Create transaction")
+        print("  POST /api/transactions/batch - Create transactions in bulk")
         print("\nPress Ctrl+C to stop the server")
         
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopped")
+        finally:
+            ACCESS_LOG.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Hot/cold partitioning for the Payment App transactions table
+Old COMPLETED/FAILED transactions are moved into per-month SQLite archive
+files, and history queries read across the hot table and the archives
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+
+ARCHIVE_DIR = 'archive'
+# Settled transactions older than this are moved out of the hot table
+ARCHIVE_AFTER_DAYS = 90
+# Rows moved per write transaction, keeps the hot database lock short
+ARCHIVE_CHUNK_SIZE = 500
+ARCHIVE_STATUSES = ('COMPLETED', 'FAILED')
+
+COLUMNS = [
+    'id', 'transactionId', 'senderId', 'recipientId', 'amount', 'currency', 'status',
+    'paymentMethod', 'description', 'createdAt', 'updatedAt', 'completedAt'
+]
+
+ARCHIVE_NAME = re.compile(r'^transactions-(\d{4}-\d{2})\.db$')
+
+# Hot table indexes used by history queries, the archival job and journal audits
+TRANSACTION_INDEXES = {
+    'idx_transactions_sender': 'senderId, createdAt',
+    'idx_transactions_recipient': 'recipientId, createdAt',
+    'idx_transactions_status_created': 'status, createdAt',
+    'idx_transactions_created': 'createdAt'
+}
+
+
+def archive_path(archive_dir, month):
+    """Path of the archive file holding a YYYY-MM month"""
+    return os.path.join(archive_dir, f"transactions-{month}.db")
+
+
+def archive_months(archive_dir=ARCHIVE_DIR):
+    """Months that have an archive file, newest first"""
+    if not os.path.isdir(archive_dir):
+        return []
+    months = [m.group(1) for m in map(ARCHIVE_NAME.match, os.listdir(archive_dir)) if m]
+    return sorted(months, reverse=True)
+
+
+def ensure_transaction_indexes(conn):
+    """Create the hot table indexes if missing; safe to run on every startup"""
+    for name, columns in TRANSACTION_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON transactions ({columns})')
+
+
+def _prepare_archive(conn):
+    """Create the archive table and its history indexes if missing"""
+    conn.execute('CREATE TABLE IF NOT EXISTS archive.transactions AS SELECT * FROM main.transactions WHERE 0')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archive_id ON transactions (id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_sender ON transactions (senderId, createdAt)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_recipient ON transactions (recipientId, createdAt)')
+
+
+def archive_old_transactions(db_path='dev.db', archive_dir=ARCHIVE_DIR, max_age_days=ARCHIVE_AFTER_DAYS,
+                             chunk_size=ARCHIVE_CHUNK_SIZE, pause=0.05):
+    """Move settled transactions older than max_age_days into monthly archives
+
+    Each chunk is copied and deleted inside one short transaction spanning the
+    hot database and the attached archive, so a crash never loses or
+    duplicates rows. Returns the number of rows moved.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    ensure_transaction_indexes(conn)
+
+    placeholders = ','.join('?' * len(ARCHIVE_STATUSES))
+    moved = 0
+    try:
+        while True:
+            cursor = conn.execute(f'''
+                SELECT id, substr(createdAt, 1, 7) FROM transactions
+                WHERE status IN ({placeholders}) AND createdAt < datetime('now', ?)
+                ORDER BY createdAt
+                LIMIT ?
+            ''', (*ARCHIVE_STATUSES, f'-{int(max_age_days)} days', chunk_size))
+            chunk = cursor.fetchall()
+            if not chunk:
+                break
+
+            by_month = {}
+            for row_id, month in chunk:
+                by_month.setdefault(month, []).append(row_id)
+
+            for month, ids in by_month.items():
+                conn.execute('ATTACH DATABASE ? AS archive', (archive_path(archive_dir, month),))
+                try:
+                    _prepare_archive(conn)
+                    id_placeholders = ','.join('?' * len(ids))
+                    conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        conn.execute(f'''
+                            INSERT OR REPLACE INTO archive.transactions
+                            SELECT * FROM main.transactions WHERE id IN ({id_placeholders})
+                        ''', ids)
+                        conn.execute(f'DELETE FROM main.transactions WHERE id IN ({id_placeholders})', ids)
+                        conn.execute('COMMIT')
+                    except Exception:
+                        conn.execute('ROLLBACK')
+                        raise
+                finally:
+                    conn.execute('DETACH DATABASE archive')
+                moved += len(ids)
+
+            # Give request handlers a chance to take the write lock
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.close()
+
+    return moved
+
+
+def _query(conn, user_id, start, end, limit):
+    """Run the history query against one database"""
+    sql = f'''
+        SELECT {', '.join(COLUMNS)} FROM transactions
+        WHERE (senderId = ? OR recipientId = ?)
+    '''
+    params = [user_id, user_id]
+    if start:
+        sql += ' AND createdAt >= ?'
+        params.append(start)
+    if end:
+        sql += ' AND createdAt < ?'
+        params.append(end)
+    sql += ' ORDER BY createdAt DESC'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [dict(zip(COLUMNS, row)) for row in conn.execute(sql, params)]
+
+
+def fetch_user_transactions(user_id, start=None, end=None, limit=None, db_path='dev.db', archive_dir=ARCHIVE_DIR):
+    """Transactions sent or received by user_id, newest first, across hot and archived data
+
+    start and end are 'YYYY-MM-DD[ HH:MM:SS]' bounds on createdAt. Only
+    archive files whose month overlaps the range are opened, and with a
+    limit the scan stops once older months cannot contribute any more rows.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = _query(conn, user_id, start, end, limit)
+    finally:
+        conn.close()
+
+    for month in archive_months(archive_dir):
+        if end and month > end[:7]:
+            continue
+        if start and month < start[:7]:
+            break
+        if limit and len(rows) >= limit and rows[limit - 1]['createdAt'][:7] > month:
+            break
+
+        uri = f"file:{archive_path(archive_dir, month)}?mode=ro"
+        archive = sqlite3.connect(uri, uri=True)
+        try:
+            rows.extend(_query(archive, user_id, start, end, limit))
+        finally:
+            archive.close()
+        rows.sort(key=lambda row: row['createdAt'] or '', reverse=True)
+
+    return rows[:limit] if limit else rows
+
+
+def main():
+    """Run the archival job"""
+    max_age_days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    print(f"Archiving settled transactions older than {max_age_days} days...")
+    moved = archive_old_transactions('dev.db', ARCHIVE_DIR, max_age_days)
+    print(f"Moved {moved} transactions into {ARCHIVE_DIR}/")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Recipient search for the Payment App
+Names and email local parts are served by an SQLite FTS5 index kept in sync
+with the users table by triggers; phone numbers by an in-memory prefix index
+"""
+
+import re
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+
+# Shortest query that hits the indexes
+MIN_QUERY_LENGTH = 2
+MAX_SEARCH_LIMIT = 20
+
+PHONE_QUERY = re.compile(r'^\+?[\d\s()-]+$')
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_phone(phone):
+    """Digits only, so '+1 (234) 567' and '1234567' share a prefix"""
+    return ''.join(ch for ch in phone or '' if ch.isdigit())
+
+
+def ensure_search_index(conn):
+    """Create the FTS5 table and sync triggers; rebuild it if out of step with users
+
+    Only the local part of each email is indexed, so searching for a domain
+    such as 'example' or 'com' cannot enumerate every user.
+    """
+    existing = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+    ).fetchone()
+    if existing and 'emailName' not in existing[0]:
+        # Earlier layout indexed full emails as an external content table
+        conn.executescript('''
+            DROP TRIGGER IF EXISTS users_fts_insert;
+            DROP TRIGGER IF EXISTS users_fts_delete;
+            DROP TRIGGER IF EXISTS users_fts_update;
+            DROP TABLE users_fts;
+        ''')
+
+    conn.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            fullName, emailName,
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, fullName, emailName)
+            VALUES (new.rowid, new.fullName, substr(new.email, 1, instr(new.email, '@') - 1));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = old.rowid;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF fullName, email ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = old.rowid;
+            INSERT INTO users_fts (rowid, fullName, emailName)
+            VALUES (new.rowid, new.fullName, substr(new.email, 1, instr(new.email, '@') - 1));
+        END;
+    ''')
+
+    # INSERT OR REPLACE does not fire delete triggers, so writes that bypass
+    # them leave stale or missing rows; rebuild whenever the rowids disagree
+    stale = conn.execute('''
+        SELECT
+            (SELECT count(*) FROM users) != (SELECT count(*) FROM users_fts)
+            OR EXISTS (
+                SELECT 1 FROM users_fts f LEFT JOIN users u ON u.rowid = f.rowid
+                WHERE u.rowid IS NULL
+            )
+    ''').fetchone()[0]
+    if stale:
+        rebuild_search_index(conn)
+    conn.commit()
+
+
+def rebuild_search_index(conn):
+    """Repopulate users_fts from the users table"""
+    conn.execute('DELETE FROM users_fts')
+    conn.execute('''
+        INSERT INTO users_fts (rowid, fullName, emailName)
+        SELECT rowid, fullName, substr(email, 1, instr(email, '@') - 1) FROM users
+    ''')
+
+
+class PhonePrefixIndex:
+    """Sorted (digits, user id) pairs answering prefix lookups with bisect"""
+
+    def __init__(self):
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def load(self, db_path='dev.db'):
+        """Build the index from every user's phone number"""
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute('SELECT phoneNumber, id FROM users').fetchall()
+        conn.close()
+
+        entries = sorted((normalize_phone(phone), user_id) for phone, user_id in rows if phone)
+        with self._lock:
+            self._entries = entries
+        return len(entries)
+
+    def add(self, user_id, phone):
+        with self._lock:
+            insort(self._entries, (normalize_phone(phone), user_id))
+
+    def remove(self, user_id, phone):
+        entry = (normalize_phone(phone), user_id)
+        with self._lock:
+            position = bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def update(self, user_id, old_phone, new_phone):
+        """Re-key a user after a phone number change"""
+        self.remove(user_id, old_phone)
+        self.add(user_id, new_phone)
+
+    def lookup(self, prefix, limit):
+        """User ids whose phone number starts with prefix"""
+        digits = normalize_phone(prefix)
+        with self._lock:
+            position = bisect_left(self._entries, (digits, ''))
+            matches = []
+            while position < len(self._entries) and len(matches) < limit:
+                phone, user_id = self._entries[position]
+                if not phone.startswith(digits):
+                    break
+                matches.append(user_id)
+                position += 1
+        return matches
+
+
+def _mask_phone(phone):
+    return '*' * max(0, len(phone) - 4) + phone[-4:] if phone else phone
+
+
+def _mask_email(email):
+    """Keep the first character and the domain: j***@example.com"""
+    if not email or '@' not in email:
+        return email
+    name, domain = email.split('@', 1)
+    return f"{name[:1]}***@{domain}"
+
+
+def search_users(conn, phone_index, query, limit=10, exclude_id=None):
+    """Find active users by name/email prefix or phone number prefix
+
+    Contact details in the results are masked; the caller is left out.
+    """
+    query = (query or '').strip()
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+
+    # Over-fetch by one so excluding the caller still fills the page
+    if PHONE_QUERY.match(query) and len(normalize_phone(query)) >= MIN_QUERY_LENGTH:
+        ids = phone_index.lookup(query, limit + 1)
+        if not ids:
+            return []
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(f'''
+            SELECT id, fullName, email, phoneNumber, role FROM users
+            WHERE isActive = 1 AND id IN ({placeholders})
+        ''', ids).fetchall()
+        order = {user_id: i for i, user_id in enumerate(ids)}
+        rows.sort(key=lambda row: order[row[0]])
+    else:
+        tokens = TOKEN.findall(query)
+        if not tokens:
+            return []
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        # No ORDER BY rank: ranking scores every match of a short prefix,
+        # while index order lets FTS5 stop after the first page
+        rows = conn.execute('''
+            SELECT u.id, u.fullName, u.email, u.phoneNumber, u.role
+            FROM users_fts
+            JOIN users u ON u.rowid = users_fts.rowid
+            WHERE users_fts MATCH ? AND u.isActive = 1
+            LIMIT ?
+        ''', (match, limit + 1)).fetchall()
+
+    return [
+        {
+            'id': row[0],
+            'fullName': row[1],
+            'email': _mask_email(row[2]),
+            'phoneNumber': _mask_phone(row[3]),
+            'role': row[4]
+        }
+        for row in rows if row[0] != exclude_id
+    ][:limit]
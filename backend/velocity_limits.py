@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+In-memory sliding-window velocity limits for the Payment App
+Keeps per-user ring buffers of transfer counts and amounts so limits can be
+checked without scanning the transactions table on every write
+"""
+
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+# Window name -> (bucket width in seconds, number of buckets)
+WINDOWS = {
+    'minute': (5, 12),
+    'hour': (60, 60),
+    'day': (3600, 24)
+}
+WINDOW_SECONDS = max(width * buckets for width, buckets in WINDOWS.values())
+
+# Role -> direction -> window -> (max count, max amount)
+DEFAULT_LIMITS = {
+    'USER': {
+        'send': {'minute': (10, 5000.0), 'hour': (60, 20000.0), 'day': (200, 50000.0)},
+        'receive': {'minute': (30, 10000.0), 'hour': (200, 50000.0), 'day': (1000, 100000.0)}
+    },
+    'MERCHANT': {
+        'send': {'minute': (5000, 500000.0), 'hour': (20000, 2000000.0), 'day': (100000, 5000000.0)},
+        'receive': {'minute': (600, 100000.0), 'hour': (10000, 1000000.0), 'day': (100000, 5000000.0)}
+    }
+}
+
+# How often idle users are dropped from memory
+EVICT_INTERVAL = 300
+
+
+def _is_positive(amount):
+    """Reject zero, negative, NaN and non-numeric amounts"""
+    return isinstance(amount, (int, float)) and not isinstance(amount, bool) and amount > 0
+
+
+class RingCounter:
+    """Fixed number of time buckets holding a transfer count and amount each"""
+
+    __slots__ = ('width', 'stamps', 'counts', 'amounts')
+
+    def __init__(self, width, buckets):
+        self.width = width
+        self.stamps = array('q', [-1]) * buckets
+        self.counts = array('I', [0]) * buckets
+        self.amounts = array('d', [0.0]) * buckets
+
+    def add(self, now, count, amount):
+        bucket = int(now // self.width)
+        slot = bucket % len(self.stamps)
+        if self.stamps[slot] != bucket:
+            self.stamps[slot] = bucket
+            self.counts[slot] = 0
+            self.amounts[slot] = 0.0
+        self.counts[slot] += count
+        self.amounts[slot] += amount
+
+    def totals(self, now):
+        """Count and amount for buckets still inside the window"""
+        oldest = int(now // self.width) - len(self.stamps)
+        count, amount = 0, 0.0
+        for slot, stamp in enumerate(self.stamps):
+            if stamp > oldest:
+                count += self.counts[slot]
+                amount += self.amounts[slot]
+        return count, amount
+
+
+class UserCounters:
+    """One ring counter per window for a single user and direction"""
+
+    __slots__ = ('windows', 'last_seen')
+
+    def __init__(self):
+        self.windows = {name: RingCounter(width, buckets) for name, (width, buckets) in WINDOWS.items()}
+        self.last_seen = 0.0
+
+
+class VelocityLimiter:
+    """Per-user transfer velocity checks for senders and recipients"""
+
+    def __init__(self, limits=None):
+        self.limits = limits or DEFAULT_LIMITS
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.time()
+
+    def _limit_error(self, direction, user_id, role, amount, now, pending):
+        """Return an error message if one more transfer would exceed a limit"""
+        role_limits = self.limits.get(role) or self.limits['USER']
+        extra_count, extra_amount = pending.get((direction, user_id), (0, 0.0)) if pending else (0, 0.0)
+        counters = self._counters.get((direction, user_id))
+        verb = 'sent' if direction == 'send' else 'received'
+
+        for window, (max_count, max_amount) in role_limits[direction].items():
+            count, total = counters.windows[window].totals(now) if counters else (0, 0.0)
+            if count + extra_count + 1 > max_count:
+                return f"Velocity limit exceeded: too many transfers {verb} per {window}"
+            if total + extra_amount + amount > max_amount:
+                return f"Velocity limit exceeded: too much {verb} per {window}"
+        return None
+
+    def check(self, sender_id, sender_role, recipient_id, recipient_role, amount, now=None, pending=None):
+        """Check a transfer against sender and recipient limits without recording it
+
+        pending maps (direction, user_id) to (count, amount) of transfers that
+        are accepted but not recorded yet, e.g. earlier items of a batch.
+        Non-positive amounts are refused, they would shrink the running totals.
+        """
+        if not _is_positive(amount):
+            return "Invalid amount"
+        now = now or time.time()
+        with self._lock:
+            return (self._limit_error('send', sender_id, sender_role, amount, now, pending)
+                    or self._limit_error('receive', recipient_id, recipient_role, amount, now, pending))
+
+    def record(self, sender_id, recipient_id, amount, now=None):
+        """Count a transfer against the sender and recipient windows"""
+        if not _is_positive(amount):
+            raise ValueError(f"Transfer amount must be positive: {amount!r}")
+        now = now or time.time()
+        with self._lock:
+            for key in (('send', sender_id), ('receive', recipient_id)):
+                counters = self._counters.get(key)
+                if counters is None:
+                    counters = self._counters[key] = UserCounters()
+                for ring in counters.windows.values():
+                    ring.add(now, 1, amount)
+                counters.last_seen = max(counters.last_seen, now)
+
+            if now - self._last_eviction >= EVICT_INTERVAL:
+                self._evict_idle(now)
+
+    def _evict_idle(self, now):
+        """Drop users with no activity inside the longest window"""
+        cutoff = now - WINDOW_SECONDS
+        for key in [key for key, counters in self._counters.items() if counters.last_seen < cutoff]:
+            del self._counters[key]
+        self._last_eviction = now
+
+    def rebuild(self, db_path='dev.db'):
+        """Load the last day of transfers from the database after a restart"""
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT senderId, recipientId, amount, createdAt
+            FROM transactions
+            WHERE createdAt >= datetime('now', ?) AND status != 'FAILED' AND amount > 0
+        ''', (f'-{WINDOW_SECONDS} seconds',))
+        rows = cursor.fetchall()
+        conn.close()
+
+        with self._lock:
+            self._counters = {}
+        for sender_id, recipient_id, amount, created_at in rows:
+            # SQLite CURRENT_TIMESTAMP values are UTC
+            created = datetime.strptime(created_at[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            self.record(sender_id, recipient_id, amount, created.timestamp())
+        return len(rows)
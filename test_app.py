@@ -7,8 +7,14 @@ This script tests the main functionality
 import requests
 import json
 import time
+import os
+import sys
+import subprocess
+import sqlite3
 
 BASE_URL = "http://localhost:3001"
+# Directory the server runs from (dev.db, journal/, archive/)
+BACKEND_DIR = os.environ.get('BACKEND_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
 
 def test_health():
     """Test health endpoint"""
@@ -122,6 +128,210 @@ def test_transaction_creation(token, recipient_id):
         print(f"❌ Transaction creation failed: {e}")
         return None
 
+def test_batch_transactions(token, recipient_id):
+    """Test batch transaction creation"""
+    print("\nTesting batch transaction creation...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        batch_data = {
+            "mode": "BEST_EFFORT",
+            "transfers": [
+                {"recipientId": recipient_id, "amount": 10.0, "description": "Payroll"},
+                {"recipientId": recipient_id, "amount": 15.0, "description": "Refund"},
+                {"recipientId": "missing-user", "amount": 5.0}
+            ]
+        }
+        
+        response = requests.post(f"{BASE_URL}/api/transactions/batch", json=batch_data, headers=headers)
+        
+        if response.status_code == 201:
+            data = response.json()
+            print("✅ Batch processed successfully")
+            print(f"   Accepted: {data['accepted']}, Rejected: {data['rejected']}")
+            return data['accepted'] == 2 and data['rejected'] == 1
+        else:
+            print(f"❌ Batch creation failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+            return False
+    except Exception as e:
+        print(f"❌ Batch creation failed: {e}")
+        return False
+
+def test_transaction_history(token):
+    """Test transaction history"""
+    print("\nTesting transaction history...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        response = requests.get(f"{BASE_URL}/api/transactions?limit=10", headers=headers)
+        
+        if response.status_code == 200:
+            data = response.json()
+            print("✅ Transaction history retrieved successfully")
+            print(f"   Transactions: {data['count']}")
+            return data['count'] > 0
+        else:
+            print(f"❌ Transaction history failed: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Transaction history failed: {e}")
+        return False
+
+def test_user_search(token, user_id):
+    """Test recipient search, masking, caller exclusion and inactive users
+
+    Needs filesystem access to the server's database (BACKEND_DIR/dev.db) to
+    deactivate and then delete the throwaway user it registers.
+    """
+    print("\nTesting recipient search...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        def search(query):
+            response = requests.get(f"{BASE_URL}/api/users/search", params={"q": query}, headers=headers)
+            response.raise_for_status()
+            return response.json()['users']
+        
+        by_name = search("jan")
+        by_phone = search("+123456789")
+        by_domain = search("example")
+        own_name = search("john")
+        
+        # Register a user, deactivate it directly in the database, search again
+        suffix = str(int(time.time()))
+        inactive_name = f"Dormant{suffix}"
+        register = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"dormant{suffix}@example.com",
+            "password": "password123",
+            "fullName": f"{inactive_name} Account",
+            "phoneNumber": f"+99{suffix}"
+        })
+        inactive_id = register.json()['user']['id']
+        found_while_active = [u['id'] for u in search(inactive_name)]
+        
+        conn = sqlite3.connect(os.path.join(BACKEND_DIR, 'dev.db'))
+        try:
+            conn.execute('UPDATE users SET isActive = 0 WHERE id = ?', (inactive_id,))
+            conn.commit()
+            found_while_inactive = [u['id'] for u in search(inactive_name) + search(f"+99{suffix}")]
+        finally:
+            # Leave no test accounts behind; the FTS delete trigger drops its entry
+            conn.execute('DELETE FROM users WHERE id = ?', (inactive_id,))
+            conn.commit()
+            conn.close()
+        
+        checks = {
+            'name match': 'Jane Smith' in [u['fullName'] for u in by_name],
+            'phone match': len(by_phone) > 0,
+            'emails masked': all('***@' in u['email'] for u in by_name + by_phone),
+            'phones masked': all(u['phoneNumber'].startswith('*') for u in by_name + by_phone),
+            'domain not searchable': by_domain == [],
+            'caller excluded': user_id not in [u['id'] for u in own_name + by_phone],
+            'active user found': inactive_id in found_while_active,
+            'inactive user hidden': inactive_id not in found_while_inactive
+        }
+        
+        failed = [name for name, passed in checks.items() if not passed]
+        if not failed:
+            print("✅ Recipient search works")
+            print(f"   Name matches: {[u['fullName'] for u in by_name]}")
+            print(f"   Phone matches: {len(by_phone)}")
+            return True
+        else:
+            print(f"❌ Recipient search failed: {', '.join(failed)}")
+            return False
+    except Exception as e:
+        print(f"❌ Recipient search failed: {e}")
+        return False
+
+def test_audit_journal(transaction_id):
+    """Test that a transfer is journaled and the journal verifies"""
+    print("\nTesting audit journal...")
+    try:
+        # Run the audit CLI the way an operator would, from the server directory
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'audit_journal.py')
+        replay = subprocess.run([sys.executable, script, 'replay'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True)
+        verify = subprocess.run([sys.executable, script, 'verify'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True)
+        journaled = f"'transactionId': '{transaction_id}'" in replay.stdout
+        
+        if journaled and replay.returncode == 0 and verify.returncode == 0:
+            print("✅ Audit journal verified")
+            print(f"   {verify.stdout.strip()}")
+            return True
+        else:
+            print("❌ Audit journal verification failed")
+            print(f"   Transaction journaled: {journaled}")
+            print(f"   {(verify.stdout + verify.stderr).strip()}")
+            return False
+    except Exception as e:
+        print(f"❌ Audit journal verification failed: {e}")
+        return False
+
+def test_velocity_limits():
+    """Test that a USER hitting the per-minute transfer limit gets 429 and cannot undo it"""
+    print("\nTesting velocity limits...")
+    try:
+        login = requests.post(f"{BASE_URL}/api/auth/login",
+                              json={"email": "user2@example.com", "password": "password123"})
+        headers = {"Authorization": f"Bearer {login.json()['token']}"}
+        
+        # A USER may send 10 transfers per minute; an 11th must be refused
+        batch_data = {
+            "mode": "BEST_EFFORT",
+            "transfers": [{"recipientId": "user-1", "amount": 1.0}] * 11
+        }
+        batch = requests.post(f"{BASE_URL}/api/transactions/batch", json=batch_data, headers=headers)
+        limited = [r for r in batch.json().get('results', [])
+                   if r.get('error', '').startswith('Velocity limit exceeded')]
+        
+        # A negative transfer must not be accepted to pull the window totals back down
+        negative = requests.post(f"{BASE_URL}/api/transactions",
+                                 json={"recipientId": "user-1", "amount": -100000}, headers=headers)
+        single = requests.post(f"{BASE_URL}/api/transactions",
+                               json={"recipientId": "user-1", "amount": 1.0}, headers=headers)
+        
+        if limited and negative.status_code == 400 and single.status_code == 429:
+            print("✅ Velocity limits enforced")
+            print(f"   Batch items over the limit: {len(limited)}")
+            return True
+        else:
+            print(f"❌ Velocity limits not enforced: {len(limited)} limited, "
+                  f"negative transfer {negative.status_code}, single transfer {single.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Velocity limit test failed: {e}")
+        return False
+
+def test_request_ids():
+    """Test X-Request-ID round-trip and its presence in error bodies"""
+    print("\nTesting request ids...")
+    try:
+        supplied = f"test-{int(time.time())}"
+        echoed = requests.get(f"{BASE_URL}/api/users/profile",
+                              headers={"Authorization": "Bearer invalid", "X-Request-ID": supplied})
+        generated = requests.get(f"{BASE_URL}/api/does-not-exist")
+        generated_id = generated.headers.get('X-Request-ID')
+        
+        checks = {
+            'supplied id echoed': echoed.headers.get('X-Request-ID') == supplied,
+            'supplied id in error body': supplied in echoed.text,
+            'id generated': bool(generated_id),
+            'generated id in error body': bool(generated_id) and generated_id in generated.text
+        }
+        
+        failed = [name for name, passed in checks.items() if not passed]
+        if not failed:
+            print("✅ Request ids propagated")
+            print(f"   Generated id: {generated_id}")
+            return True
+        else:
+            print(f"❌ Request id test failed: {', '.join(failed)}")
+            return False
+    except Exception as e:
+        print(f"❌ Request id test failed: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("🧪 Payment App Test Suite")
@@ -157,6 +367,36 @@ def main():
         print("\n❌ Transaction creation failed.")
         return
     
+    # Test batch transaction creation
+    if not test_batch_transactions(token, other_user_id):
+        print("\n❌ Batch transaction creation failed.")
+        return
+    
+    # Test audit journal
+    if not test_audit_journal(transaction['transactionId']):
+        print("\n❌ Audit journal verification failed.")
+        return
+    
+    # Test transaction history
+    if not test_transaction_history(token):
+        print("\n❌ Transaction history failed.")
+        return
+    
+    # Test recipient search
+    if not test_user_search(token, user['id']):
+        print("\n❌ Recipient search failed.")
+        return
+    
+    # Test request id propagation
+    if not test_request_ids():
+        print("\n❌ Request id test failed.")
+        return
+    
+    # Test velocity limits (exhausts user-2's per-minute budget, so run last)
+    if not test_velocity_limits():
+        print("\n❌ Velocity limit test failed.")
+        return
+    
     print("\n" + "=" * 50)
     print("🎉 All tests passed! The Payment App is working correctly.")
     print("\n📋 Summary:")
@@ -165,6 +405,12 @@ def main():
     print(f"   ✅ Profile data persists")
     print(f"   ✅ QR code generation works")
     print(f"   ✅ Transaction creation works")
+    print(f"   ✅ Batch transactions work")
+    print(f"   ✅ Audit journal verifies")
+    print(f"   ✅ Transaction history works")
+    print(f"   ✅ Recipient search works")
+    print(f"   ✅ Request ids are propagated")
+    print(f"   ✅ Velocity limits are enforced")
     print(f"   ✅ Only database users can send funds")
     print("\n🚀 You can now use the frontend applications!")
 